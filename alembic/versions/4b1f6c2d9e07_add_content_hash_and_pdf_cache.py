@@ -0,0 +1,39 @@
+"""Add job_files.content_hash and the pdf_cache table
+
+Revision ID: 4b1f6c2d9e07
+Revises: 
+Create Date: 2026-10-15 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1f6c2d9e07'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Databases first created after this change already have the new schema
+    # from create_all(), so only add what is missing
+    inspector = sa.inspect(op.get_bind())
+    
+    job_file_columns = {column["name"] for column in inspector.get_columns("job_files")}
+    if "content_hash" not in job_file_columns:
+        op.add_column("job_files", sa.Column("content_hash", sa.String(32), nullable=True))
+    
+    if not inspector.has_table("pdf_cache"):
+        op.create_table(
+            "pdf_cache",
+            sa.Column("content_hash", sa.String(32), primary_key=True),
+            sa.Column("pdf_path", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("pdf_cache")
+    op.drop_column("job_files", "content_hash")
@@ -0,0 +1,60 @@
+"""Store job and file statuses as SMALLINT codes
+
+Revision ID: 9d2e7a4c1f38
+Revises: 4b1f6c2d9e07
+Create Date: 2026-10-15 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e7a4c1f38'
+down_revision = '4b1f6c2d9e07'
+branch_labels = None
+depends_on = None
+
+# Must match app.database.STATUS_CODES
+STATUS_CODES = {"PENDING": 0, "IN_PROGRESS": 1, "COMPLETED": 2, "FAILED": 3}
+
+STATUS_COLUMNS = {"jobs": "jobstatus", "job_files": "filestatus"}
+
+
+def _code_case():
+    whens = " ".join(f"WHEN '{name}' THEN {code}" for name, code in STATUS_CODES.items())
+    return f"CASE status::text {whens} END"
+
+
+def _name_case():
+    whens = " ".join(f"WHEN {code} THEN '{name}'" for name, code in STATUS_CODES.items())
+    return f"CASE status {whens} END"
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    
+    # Only Postgres had native ENUM columns; skip tables already converted
+    # or created as SMALLINT by create_all()
+    if bind.dialect.name == "postgresql":
+        for table, enum_name in STATUS_COLUMNS.items():
+            status = next(c for c in inspector.get_columns(table) if c["name"] == "status")
+            if isinstance(status["type"], sa.Enum):
+                op.execute(f"ALTER TABLE {table} ALTER COLUMN status DROP DEFAULT")
+                op.execute(f"ALTER TABLE {table} ALTER COLUMN status TYPE SMALLINT USING {_code_case()}")
+            op.execute(f"DROP TYPE IF EXISTS {enum_name}")
+    
+    job_file_indexes = {index["name"] for index in inspector.get_indexes("job_files")}
+    if "ix_jobfile_job_status" not in job_file_indexes:
+        op.create_index("ix_jobfile_job_status", "job_files", ["job_id", "status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobfile_job_status", table_name="job_files")
+    
+    if op.get_bind().dialect.name == "postgresql":
+        for table, enum_name in STATUS_COLUMNS.items():
+            names = ", ".join(f"'{name}'" for name in STATUS_CODES)
+            op.execute(f"CREATE TYPE {enum_name} AS ENUM ({names})")
+            op.execute(f"ALTER TABLE {table} ALTER COLUMN status TYPE {enum_name} USING ({_name_case()})::{enum_name}")
@@ -0,0 +1,39 @@
+"""Index job_files by job and reference jobs.id
+
+Revision ID: c5a8e1b3d6f2
+Revises: 9d2e7a4c1f38
+Create Date: 2026-10-15 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a8e1b3d6f2'
+down_revision = '9d2e7a4c1f38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    
+    job_file_indexes = {index["name"] for index in inspector.get_indexes("job_files")}
+    if "ix_job_files_job_id" not in job_file_indexes:
+        op.create_index("ix_job_files_job_id", "job_files", ["job_id"])
+    if "ix_jobfile_job_filename" not in job_file_indexes:
+        op.create_index("ix_jobfile_job_filename", "job_files", ["job_id", "filename"])
+    
+    # SQLite cannot add constraints to an existing table
+    foreign_keys = inspector.get_foreign_keys("job_files")
+    if bind.dialect.name != "sqlite" and not any(fk["referred_table"] == "jobs" for fk in foreign_keys):
+        op.create_foreign_key("job_files_job_id_fkey", "job_files", "jobs", ["job_id"], ["id"])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        op.drop_constraint("job_files_job_id_fkey", "job_files", type_="foreignkey")
+    op.drop_index("ix_jobfile_job_filename", table_name="job_files")
+    op.drop_index("ix_job_files_job_id", table_name="job_files")
@@ -0,0 +1,83 @@
+import json
+import redis
+import redis.asyncio as aioredis
+
+from app.config import settings
+from app.database import JobStatus
+
+# Running jobs change constantly, so their cached responses only absorb bursts
+# of polling; finished jobs never change and can be cached for much longer
+ACTIVE_JOB_TTL = 1
+FINISHED_JOB_TTL = 3600
+
+# Long enough for a queued job to be picked up by a worker
+JOB_MANIFEST_TTL = 3600
+
+# Lazy initialization
+_redis = None
+_async_redis = None
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.redis_url, socket_connect_timeout=1, socket_timeout=1)
+    return _redis
+
+def get_async_redis():
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.from_url(settings.redis_url, socket_connect_timeout=1, socket_timeout=1)
+    return _async_redis
+
+def job_status_key(job_id) -> str:
+    return f"jobstatus:{job_id}"
+
+def job_files_key(job_id) -> str:
+    return f"jobfiles:{job_id}"
+
+def job_manifest_key(job_id) -> str:
+    return f"job:{job_id}:manifest"
+
+async def get_cached_response(key: str):
+    """Return a cached JSON response body, or None on a miss or if Redis is unavailable"""
+    try:
+        return await get_async_redis().get(key)
+    except redis.RedisError as e:
+        print(f"⚠️  Cache read failed: {e}")
+        return None
+
+async def cache_response(key: str, body, job_status: JobStatus):
+    """Cache a JSON response body with a TTL based on the job's status"""
+    ttl = FINISHED_JOB_TTL if job_status in (JobStatus.COMPLETED, JobStatus.FAILED) else ACTIVE_JOB_TTL
+    try:
+        await get_async_redis().set(key, body, ex=ttl)
+    except redis.RedisError as e:
+        print(f"⚠️  Cache write failed: {e}")
+
+def invalidate_job_cache(job_id):
+    """Drop cached status responses for a job after its state changes"""
+    try:
+        get_redis().delete(job_status_key(job_id), job_files_key(job_id))
+    except redis.RedisError as e:
+        print(f"⚠️  Cache invalidation failed: {e}")
+
+
+async def store_job_manifest(job_id, job_files: list):
+    """Publish a job's file list so the worker can start without querying Postgres"""
+    manifest = [
+        [str(jf["id"]), jf["original_path"], jf["content_hash"]]
+        for jf in job_files
+    ]
+    try:
+        await get_async_redis().set(job_manifest_key(job_id), json.dumps(manifest), ex=JOB_MANIFEST_TTL)
+    except redis.RedisError as e:
+        print(f"⚠️  Job manifest write failed: {e}")
+
+def load_job_manifest(job_id):
+    """Return a job's [file_id, original_path, content_hash] entries, or None if unavailable"""
+    try:
+        manifest = get_redis().get(job_manifest_key(job_id))
+    except redis.RedisError as e:
+        print(f"⚠️  Job manifest read failed: {e}")
+        return None
+    return json.loads(manifest) if manifest else None
@@ -12,10 +12,17 @@ class Settings(BaseSettings):
     output_dir: str = os.getenv("OUTPUT_DIR", "./storage/outputs")
     archive_dir: str = os.getenv("ARCHIVE_DIR", "./storage/archives")
     
+    # When set, downloads are handed to a fronting Nginx via X-Accel-Redirect
+    # under this internal location (e.g. "/protected") so it can sendfile() them
+    x_accel_redirect_prefix: str = os.getenv("X_ACCEL_REDIRECT_PREFIX", "")
+    
     # File size limits
     max_file_size: int = 50 * 1024 * 1024  # 50MB
     max_files_per_job: int = 1000
     
+    # Number of LibreOffice processes converting one job's files in parallel
+    conversion_workers: int = int(os.getenv("CONVERSION_WORKERS", os.cpu_count() or 1))
+    
     class Config:
         env_file = ".env"
 
@@ -1,7 +1,7 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Integer, Text, Enum
+from sqlalchemy import create_engine, Column, String, DateTime, Integer, SmallInteger, Text, ForeignKey, Index, Uuid
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from fastapi import HTTPException
 import uuid
 from datetime import datetime
@@ -25,17 +25,46 @@ def get_database_url():
     print("⚠️  No DATABASE_URL environment variable found")
     return None
 
+# Connection pool sized for concurrent API requests and Celery worker processes.
+# LIFO keeps recently used connections warm; pre-ping discards stale ones.
+POOL_OPTIONS = dict(
+    pool_size=10,
+    max_overflow=20,
+    pool_timeout=30,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+    pool_use_lifo=True
+)
+
 # Create engine with proper error handling
-def create_database_engine():
-    database_url = get_database_url()
+def create_database_engine(database_url=None):
+    database_url = database_url or get_database_url()
     if not database_url:
         raise Exception("No DATABASE_URL provided - cannot create database engine")
     print(f"Connecting to database: {database_url.split('@')[1] if '@' in database_url else 'localhost'}")
-    return create_engine(database_url)
+    # Batch executemany() INSERTs into multi-row VALUES statements
+    return create_engine(
+        database_url,
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=1000,
+        **POOL_OPTIONS
+    )
+
+# The API uses asyncpg so queries don't occupy threadpool workers;
+# the Celery worker keeps the sync psycopg2 engine above
+def create_async_database_engine():
+    database_url = get_database_url()
+    if not database_url:
+        raise Exception("No DATABASE_URL provided - cannot create database engine")
+    return create_async_engine(
+        database_url.replace("postgresql://", "postgresql+asyncpg://", 1),
+        **POOL_OPTIONS
+    )
 
 # Lazy initialization
 _engine = None
-_SessionLocal = None
+_async_engine = None
+_AsyncSessionLocal = None
 
 def get_engine():
     global _engine
@@ -43,11 +72,21 @@ def get_engine():
         _engine = create_database_engine()
     return _engine
 
-def get_session_local():
-    global _SessionLocal
-    if _SessionLocal is None:
-        _SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
-    return _SessionLocal
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_database_engine()
+    return _async_engine
+
+def get_async_session_local():
+    global _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        _AsyncSessionLocal = async_sessionmaker(
+            get_async_engine(),
+            autoflush=False,
+            expire_on_commit=False
+        )
+    return _AsyncSessionLocal
 
 Base = declarative_base()
 
@@ -63,11 +102,34 @@ class FileStatus(enum.Enum):
     COMPLETED = "COMPLETED"
     FAILED = "FAILED"
 
+# Stored status codes; these values are persisted and must never be renumbered
+STATUS_CODES = {"PENDING": 0, "IN_PROGRESS": 1, "COMPLETED": 2, "FAILED": 3}
+
+class SmallIntEnum(TypeDecorator):
+    """Stores a status Enum as a SMALLINT using the fixed STATUS_CODES mapping"""
+    impl = SmallInteger
+    cache_ok = True
+    
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+        self._members = {code: enum_class[name] for name, code in STATUS_CODES.items()}
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return STATUS_CODES[self.enum_class(value).name]
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._members[value]
+
 class Job(Base):
     __tablename__ = "jobs"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    status = Column(Enum(JobStatus), default=JobStatus.PENDING)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    status = Column(SmallIntEnum(JobStatus), default=JobStatus.PENDING)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     file_count = Column(Integer, default=0)
@@ -76,20 +138,33 @@ class Job(Base):
 class JobFile(Base):
     __tablename__ = "job_files"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    job_id = Column(UUID(as_uuid=True), nullable=False)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    job_id = Column(Uuid(as_uuid=True), ForeignKey("jobs.id"), nullable=False, index=True)
     filename = Column(String, nullable=False)
     original_path = Column(String, nullable=False)
     output_path = Column(String, nullable=True)
-    status = Column(Enum(FileStatus), default=FileStatus.PENDING)
+    content_hash = Column(String(32), nullable=True)
+    status = Column(SmallIntEnum(FileStatus), default=FileStatus.PENDING)
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_jobfile_job_filename", "job_id", "filename"),
+        Index("ix_jobfile_job_status", "job_id", "status"),
+    )
+
+class PdfCache(Base):
+    """Converted PDF for each distinct DOCX content hash, reused across jobs"""
+    __tablename__ = "pdf_cache"
+    
+    content_hash = Column(String(32), primary_key=True)
+    pdf_path = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
-def get_db():
+async def get_db():
     try:
-        db = get_session_local()()
-        yield db
+        db = get_async_session_local()()
     except Exception as e:
         print(f"❌ Database connection failed: {e}")
         # Return a mock session that will raise an error when used
@@ -97,11 +172,12 @@ def get_db():
             def __getattr__(self, name):
                 raise HTTPException(status_code=503, detail="Database not available")
         yield MockSession()
+        return
+    
+    try:
+        yield db
     finally:
-        try:
-            db.close()
-        except:
-            pass
+        await db.close()
 
 def create_tables():
     try:
@@ -1,23 +1,186 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget
 from typing import List
+from urllib.parse import quote
+import hashlib
 import os
+import shutil
 import uuid
+import anyio
 from datetime import datetime
 
-from app.database import get_db, create_tables, Job, JobFile, JobStatus, FileStatus
-from app.models import JobResponse, JobStatusResponse, FileStatusResponse
+from app.database import get_db, get_async_session_local, create_tables, Job, JobFile, JobStatus, FileStatus
+from app.models import JobResponse, JobStatusResponse
 from app.worker import process_job
+from app.cache import get_cached_response, cache_response, store_job_manifest, job_status_key, job_files_key
 from app.config import settings
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+UPLOAD_CONCURRENCY = 8  # Files of one submission written to disk at once
+
 app = FastAPI(
     title="Bulk Document Conversion Service",
     description="Convert DOCX files to PDF in bulk with asynchronous processing",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+def _save_upload(src, file_path: str):
+    """
+    Stream an uploaded file to disk in fixed-size chunks.
+
+    Runs entirely inside one worker thread so each file costs a single
+    thread hop instead of one per chunk read and write. Returns the
+    content hash used to deduplicate conversions, or None if the file
+    exceeds the configured maximum size.
+    """
+    total = 0
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, "wb") as buffer:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            total += len(chunk)
+            if total > settings.max_file_size:
+                return None
+            content_hash.update(chunk)
+            buffer.write(chunk)
+    return content_hash.hexdigest()
+
+def _is_safe_filename(filename: str) -> bool:
+    """True if an uploaded file name cannot point outside the job's upload directory"""
+    return (
+        os.path.basename(filename) == filename
+        and os.sep not in filename
+        and not (os.altsep and os.altsep in filename)
+        and ".." not in filename
+    )
+
+class _JobUploadTarget(BaseTarget):
+    """
+    Streaming multipart target that writes every file part straight into a
+    job's upload directory, enforcing type, count and size limits and hashing
+    the content as it arrives.
+    """
+    
+    def __init__(self, job_id: uuid.UUID, job_upload_dir: str):
+        super().__init__()
+        self.job_id = job_id
+        self.job_upload_dir = job_upload_dir
+        self.job_files = []
+        self._filenames = set()
+        self._file = None
+    
+    def on_start(self):
+        filename = self.multipart_filename
+        if not filename or not filename.lower().endswith('.docx'):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type: {filename}. Only DOCX files are allowed."
+            )
+        if not _is_safe_filename(filename):
+            raise HTTPException(status_code=400, detail=f"Invalid file name: {filename}")
+        if len(self.job_files) >= settings.max_files_per_job:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many files. Maximum allowed: {settings.max_files_per_job}"
+            )
+        if filename in self._filenames:
+            raise HTTPException(status_code=400, detail=f"Duplicate file name: {filename}")
+        self._filenames.add(filename)
+        
+        self._path = os.path.join(self.job_upload_dir, filename)
+        self._size = 0
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._file = open(self._path, "wb")
+    
+    def on_data_received(self, chunk: bytes):
+        self._size += len(chunk)
+        if self._size > settings.max_file_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large: {self.multipart_filename}. Maximum size: {settings.max_file_size} bytes"
+            )
+        self._hash.update(chunk)
+        self._file.write(chunk)
+    
+    def on_finish(self):
+        self.close()
+        self.job_files.append({
+            "id": uuid.uuid4(),
+            "job_id": self.job_id,
+            "filename": self.multipart_filename,
+            "original_path": self._path,
+            "content_hash": self._hash.hexdigest()
+        })
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+async def _discard_upload_dir(job_upload_dir: str):
+    """Remove a rejected or failed job's partially written uploads"""
+    # Shielded so the cleanup still runs when the request is cancelled
+    with anyio.CancelScope(shield=True):
+        await run_in_threadpool(shutil.rmtree, job_upload_dir, True)
+
+async def _create_job(db: AsyncSession, job_id: uuid.UUID, job_files: list) -> JobResponse:
+    """Record a job whose files are already on disk and queue it for conversion"""
+    # Create the job and its file records in one transaction
+    job = Job(id=job_id, file_count=len(job_files))
+    db.add(job)
+    await db.flush()
+    await db.execute(insert(JobFile), job_files)
+    await db.commit()
+    
+    # Queue the job for processing
+    await store_job_manifest(job.id, job_files)
+    process_job.delay(str(job.id))
+    
+    return JobResponse(job_id=str(job.id), file_count=len(job_files))
+
+def _file_download(path: str, media_type: str, filename: str) -> Response:
+    """
+    Return a download response for a file in storage.
+    
+    Behind Nginx with X_ACCEL_REDIRECT_PREFIX set, only the headers are sent
+    and Nginx serves the body itself with sendfile(); otherwise the file is
+    streamed by the app.
+    """
+    if not settings.x_accel_redirect_prefix:
+        return FileResponse(path, media_type=media_type, filename=filename)
+    
+    # Paths are mapped relative to the directory that holds the outputs and archives
+    storage_root = os.path.commonpath([
+        os.path.abspath(settings.output_dir),
+        os.path.abspath(settings.archive_dir)
+    ])
+    internal_path = os.path.relpath(os.path.abspath(path), storage_root)
+    if internal_path == os.pardir or internal_path.startswith(os.pardir + os.sep):
+        # Nginx can't reach files outside its storage alias, so serve them directly
+        print(f"⚠️  {path} is outside {storage_root}; serving it without X-Accel-Redirect")
+        return FileResponse(path, media_type=media_type, filename=filename)
+    
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        content_disposition = f"attachment; filename*=utf-8''{quoted_filename}"
+    else:
+        content_disposition = f'attachment; filename="{filename}"'
+    
+    return Response(
+        media_type=media_type,
+        headers={
+            "X-Accel-Redirect": f"{settings.x_accel_redirect_prefix.rstrip('/')}/{quote(internal_path)}",
+            "Content-Disposition": content_disposition
+        }
+    )
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -26,6 +189,10 @@ async def startup_event():
     try:
         print("🚀 Starting DOCX to PDF converter...")
         
+        # Cache the UI page so requests don't read it from disk
+        with open("static/index.html", "rb") as f:
+            app.state.index_html = f.read()
+        
         # Check environment variables
         database_url = os.getenv('DATABASE_URL')
         redis_url = os.getenv('REDIS_URL')
@@ -58,7 +225,7 @@ async def startup_event():
 @app.post("/api/v1/jobs", response_model=JobResponse, status_code=202)
 async def submit_job(
     files: List[UploadFile] = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Submit a new conversion job with multiple DOCX files.
@@ -73,63 +240,109 @@ async def submit_job(
             detail=f"Too many files. Maximum allowed: {settings.max_files_per_job}"
         )
     
-    # Validate file types and sizes
-    for file in files:
-        if not file.filename.lower().endswith('.docx'):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type: {file.filename}. Only DOCX files are allowed."
-            )
-        
-        # Check file size (this is approximate as we haven't read the full content yet)
-        if hasattr(file, 'size') and file.size > settings.max_file_size:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large: {file.filename}. Maximum size: {settings.max_file_size} bytes"
-            )
-    
-    # Create job record
-    job = Job(file_count=len(files))
-    db.add(job)
-    db.commit()
-    db.refresh(job)
-    
-    job_upload_dir = os.path.join(settings.upload_dir, str(job.id))
+    job_id = uuid.uuid4()
+    job_upload_dir = os.path.join(settings.upload_dir, str(job_id))
     os.makedirs(job_upload_dir, exist_ok=True)
     
-    # Save uploaded files and create file records
-    job_files = []
-    for file in files:
+    # Validate and save each file in a single pass; size is enforced while
+    # streaming, so no file is ever read twice. Files are written concurrently
+    # by a bounded number of worker threads.
+    job_files = [None] * len(files)
+    errors = []
+    limiter = anyio.CapacityLimiter(UPLOAD_CONCURRENCY)
+    
+    async def save_one(index: int, file: UploadFile):
+        if errors:
+            return
+        
         file_path = os.path.join(job_upload_dir, file.filename)
+        content_hash = await anyio.to_thread.run_sync(_save_upload, file.file, file_path, limiter=limiter)
+        if content_hash is None:
+            errors.append(f"File too large: {file.filename}. Maximum size: {settings.max_file_size} bytes")
+            return
         
-        # Save file to disk
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            if len(content) > settings.max_file_size:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File too large: {file.filename}. Maximum size: {settings.max_file_size} bytes"
-                )
-            buffer.write(content)
+        job_files[index] = {
+            "id": uuid.uuid4(),
+            "job_id": job_id,
+            "filename": file.filename,
+            "original_path": file_path,
+            "content_hash": content_hash
+        }
+    
+    try:
+        async with anyio.create_task_group() as tg:
+            seen_filenames = set()
+            for index, file in enumerate(files):
+                if not file.filename.lower().endswith('.docx'):
+                    errors.append(f"Invalid file type: {file.filename}. Only DOCX files are allowed.")
+                    break
+                if not _is_safe_filename(file.filename):
+                    errors.append(f"Invalid file name: {file.filename}")
+                    break
+                if file.filename in seen_filenames:
+                    errors.append(f"Duplicate file name: {file.filename}")
+                    break
+                seen_filenames.add(file.filename)
+                tg.start_soon(save_one, index, file)
         
-        # Create file record
-        job_file = JobFile(
-            job_id=job.id,
-            filename=file.filename,
-            original_path=file_path
-        )
-        db.add(job_file)
-        job_files.append(job_file)
+        if errors:
+            raise HTTPException(status_code=400, detail=errors[0])
+        
+        return await _create_job(db, job_id, job_files)
+    except BaseException:
+        await _discard_upload_dir(job_upload_dir)
+        raise
+
+@app.post("/api/v1/jobs/stream", response_model=JobResponse, status_code=202)
+async def submit_job_stream(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Submit a new conversion job by streaming the upload straight to disk.
     
-    db.commit()
+    Accepts the same multipart `files` fields as `POST /api/v1/jobs`, but the
+    body is parsed as it arrives instead of being spooled to temporary files
+    before the request is handled. Memory use stays constant regardless of
+    the total upload size.
     
-    # Queue the job for processing
-    process_job.delay(str(job.id))
+    Returns a job_id for tracking the conversion progress.
+    """
+    job_id = uuid.uuid4()
+    job_upload_dir = os.path.join(settings.upload_dir, str(job_id))
+    os.makedirs(job_upload_dir, exist_ok=True)
     
-    return JobResponse(job_id=str(job.id), file_count=len(files))
+    target = _JobUploadTarget(job_id, job_upload_dir)
+    try:
+        try:
+            parser = StreamingFormDataParser(headers=request.headers)
+            parser.register("files", target)
+            # Parsing and writing happen off the event loop. Body chunks are
+            # often only a few KiB, so buffer about UPLOAD_CHUNK_SIZE per
+            # threadpool hop
+            pending = []
+            pending_size = 0
+            async for chunk in request.stream():
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size >= UPLOAD_CHUNK_SIZE:
+                    await run_in_threadpool(parser.data_received, b"".join(pending))
+                    pending = []
+                    pending_size = 0
+            if pending:
+                await run_in_threadpool(parser.data_received, b"".join(pending))
+        except (ParseFailedException, ValueError):
+            raise HTTPException(status_code=400, detail="Malformed multipart request")
+        finally:
+            target.close()
+        
+        if not target.job_files:
+            raise HTTPException(status_code=400, detail="No files uploaded")
+        
+        return await _create_job(db, job_id, target.job_files)
+    except BaseException:
+        await _discard_upload_dir(job_upload_dir)
+        raise
 
 @app.get("/api/v1/jobs/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: str, db: Session = Depends(get_db)):
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_db)):
     """
     Get the status of a conversion job.
     
@@ -142,35 +355,41 @@ async def get_job_status(job_id: str, db: Session = Depends(get_db)):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid job ID format")
     
-    job = db.query(Job).filter(Job.id == job_uuid).first()
+    cached = await get_cached_response(job_status_key(job_uuid))
+    if cached:
+        return Response(content=cached, media_type="application/json")
+    
+    # Fetch plain rows and serialize them directly instead of building ORM
+    # objects and a Pydantic model per file
+    result = await db.execute(
+        select(Job.id, Job.status, Job.created_at, Job.archive_path).where(Job.id == job_uuid)
+    )
+    job = result.first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job_files = db.query(JobFile).filter(JobFile.job_id == job_uuid).all()
-    
-    files_status = [
-        FileStatusResponse(
-            filename=jf.filename,
-            status=jf.status,
-            error_message=jf.error_message
-        )
-        for jf in job_files
-    ]
+    result = await db.execute(
+        select(JobFile.filename, JobFile.status, JobFile.error_message).where(JobFile.job_id == job_uuid)
+    )
+    files_status = [dict(row) for row in result.mappings()]
     
     download_url = None
     if job.status == JobStatus.COMPLETED and job.archive_path:
         download_url = f"/api/v1/jobs/{job_id}/download"
     
-    return JobStatusResponse(
-        job_id=str(job.id),
-        status=job.status,
-        created_at=job.created_at,
-        download_url=download_url,
-        files=files_status
-    )
+    response = ORJSONResponse({
+        "job_id": str(job.id),
+        "status": job.status,
+        "created_at": job.created_at,
+        "download_url": download_url,
+        "files": files_status
+    })
+    await cache_response(job_status_key(job_uuid), response.body, job.status)
+    
+    return response
 
 @app.get("/api/v1/jobs/{job_id}/download")
-async def download_results(job_id: str, db: Session = Depends(get_db)):
+async def download_results(job_id: str, db: AsyncSession = Depends(get_db)):
     """
     Download the converted files as a ZIP archive.
     
@@ -183,24 +402,24 @@ async def download_results(job_id: str, db: Session = Depends(get_db)):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid job ID format")
     
-    job = db.query(Job).filter(Job.id == job_uuid).first()
+    job = await db.get(Job, job_uuid)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
     if job.status != JobStatus.COMPLETED:
         raise HTTPException(status_code=400, detail="Job is not completed yet")
     
-    if not job.archive_path or not os.path.exists(job.archive_path):
+    if not job.archive_path or not await run_in_threadpool(os.path.exists, job.archive_path):
         raise HTTPException(status_code=404, detail="Archive file not found")
     
-    return FileResponse(
+    return _file_download(
         job.archive_path,
         media_type="application/zip",
         filename=f"converted_files_{job_id}.zip"
     )
 
 @app.get("/api/v1/jobs/{job_id}/files")
-async def list_job_files(job_id: str, db: Session = Depends(get_db)):
+async def list_job_files(job_id: str, db: AsyncSession = Depends(get_db)):
     """
     List all files in a job with their download links.
     
@@ -213,14 +432,23 @@ async def list_job_files(job_id: str, db: Session = Depends(get_db)):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid job ID format")
     
-    job = db.query(Job).filter(Job.id == job_uuid).first()
+    cached = await get_cached_response(job_files_key(job_uuid))
+    if cached:
+        return Response(content=cached, media_type="application/json")
+    
+    result = await db.execute(select(Job.id, Job.status).where(Job.id == job_uuid))
+    job = result.first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job_files = db.query(JobFile).filter(JobFile.job_id == job_uuid).all()
+    result = await db.execute(
+        select(
+            JobFile.filename, JobFile.status, JobFile.error_message, JobFile.output_path
+        ).where(JobFile.job_id == job_uuid)
+    )
     
     files_info = []
-    for jf in job_files:
+    for jf in result:
         download_url = None
         if jf.status == FileStatus.COMPLETED and jf.output_path:
             download_url = f"/api/v1/jobs/{job_id}/files/{jf.filename}/download"
@@ -232,14 +460,17 @@ async def list_job_files(job_id: str, db: Session = Depends(get_db)):
             "download_url": download_url
         })
     
-    return {
+    response = ORJSONResponse({
         "job_id": str(job.id),
         "job_status": job.status,
         "files": files_info
-    }
+    })
+    await cache_response(job_files_key(job_uuid), response.body, job.status)
+    
+    return response
 
 @app.get("/api/v1/jobs/{job_id}/files/{filename}/download")
-async def download_individual_pdf(job_id: str, filename: str, db: Session = Depends(get_db)):
+async def download_individual_pdf(job_id: str, filename: str, db: AsyncSession = Depends(get_db)):
     """
     Download a specific converted PDF file directly.
     
@@ -253,15 +484,18 @@ async def download_individual_pdf(job_id: str, filename: str, db: Session = Depe
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid job ID format")
     
-    job = db.query(Job).filter(Job.id == job_uuid).first()
+    job = await db.get(Job, job_uuid)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
     # Find the specific file
-    job_file = db.query(JobFile).filter(
-        JobFile.job_id == job_uuid,
-        JobFile.filename == filename
-    ).first()
+    result = await db.execute(
+        select(JobFile).where(
+            JobFile.job_id == job_uuid,
+            JobFile.filename == filename
+        )
+    )
+    job_file = result.scalars().first()
     
     if not job_file:
         raise HTTPException(status_code=404, detail="File not found in this job")
@@ -269,14 +503,14 @@ async def download_individual_pdf(job_id: str, filename: str, db: Session = Depe
     if job_file.status != FileStatus.COMPLETED:
         raise HTTPException(status_code=400, detail="File conversion is not completed yet")
     
-    if not job_file.output_path or not os.path.exists(job_file.output_path):
+    if not job_file.output_path or not await run_in_threadpool(os.path.exists, job_file.output_path):
         raise HTTPException(status_code=404, detail="Converted PDF file not found")
     
     # Get the original filename without extension and add .pdf
     original_name = os.path.splitext(job_file.filename)[0]
     pdf_filename = f"{original_name}.pdf"
     
-    return FileResponse(
+    return _file_download(
         job_file.output_path,
         media_type="application/pdf",
         filename=pdf_filename
@@ -285,17 +519,15 @@ async def download_individual_pdf(job_id: str, filename: str, db: Session = Depe
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve the main UI page"""
-    with open("static/index.html", "r") as f:
-        return HTMLResponse(content=f.read())
+    return HTMLResponse(content=app.state.index_html)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
         # Test database connection
-        db = next(get_db())
-        db.execute("SELECT 1")
-        db.close()
+        async with get_async_session_local()() as db:
+            await db.execute(text("SELECT 1"))
         db_status = "connected"
     except Exception as e:
         db_status = f"error: {str(e)[:100]}"
@@ -1,31 +1,47 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
+from fastapi.responses import FileResponse
 import tempfile
 import os
+import uuid
 from io import BytesIO
+import redis
 
-from app.main import app
-from app.database import Base, get_db
+from app.main import app, _file_download
+from app.database import Base, get_db, Job, JobFile, JobStatus, FileStatus
 from app.config import settings
+from app import cache
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
 
 @pytest.fixture
-def client():
+def upload_dir(tmp_path, monkeypatch):
+    """Write uploads to a temporary directory"""
+    monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def queued_jobs(monkeypatch):
+    """Record queued job ids instead of sending them to the Celery broker"""
+    queued = []
+    monkeypatch.setattr("app.main.process_job.delay", queued.append)
+    return queued
+
+@pytest.fixture
+def client(upload_dir, queued_jobs):
     Base.metadata.create_all(bind=engine)
     with TestClient(app) as c:
         yield c
@@ -54,6 +70,11 @@ def test_submit_job_success(client, sample_docx_content):
     data = response.json()
     assert "job_id" in data
     assert data["file_count"] == 2
+    
+    # Statuses are stored as the fixed STATUS_CODES values (PENDING = 0)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT status FROM jobs")).scalar() == 0
+        assert set(conn.execute(text("SELECT status FROM job_files")).scalars()) == {0}
 
 def test_submit_job_invalid_file_type(client):
     files = [
@@ -64,6 +85,38 @@ def test_submit_job_invalid_file_type(client):
     assert response.status_code == 400
     assert "Invalid file type" in response.json()["detail"]
 
+def count_rows(model):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(model)).scalar()
+
+def test_submit_job_file_too_large(client, upload_dir, queued_jobs, sample_docx_content, monkeypatch):
+    monkeypatch.setattr(settings, "max_file_size", len(sample_docx_content) - 1)
+    files = [
+        ("files", ("small.docx", BytesIO(b"PK"), "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
+        ("files", ("big.docx", BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    ]
+    
+    response = client.post("/api/v1/jobs", files=files)
+    assert response.status_code == 400
+    assert "File too large: big.docx" in response.json()["detail"]
+    
+    # Nothing from the rejected submission is left behind
+    assert os.listdir(upload_dir) == []
+    assert count_rows(Job) == 0
+    assert queued_jobs == []
+
+def test_submit_job_duplicate_filenames(client, upload_dir, sample_docx_content):
+    files = [
+        ("files", ("same.docx", BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
+        ("files", ("same.docx", BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    ]
+    
+    response = client.post("/api/v1/jobs", files=files)
+    assert response.status_code == 400
+    assert "Duplicate file name: same.docx" in response.json()["detail"]
+    assert os.listdir(upload_dir) == []
+    assert count_rows(Job) == 0
+
 def test_get_job_status_not_found(client):
     response = client.get("/api/v1/jobs/00000000-0000-0000-0000-000000000000")
     assert response.status_code == 404
@@ -74,4 +127,224 @@ def test_get_job_status_invalid_uuid(client):
 
 def test_download_job_not_found(client):
     response = client.get("/api/v1/jobs/00000000-0000-0000-0000-000000000000/download")
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def test_submit_job_stream_invalid_file_type(client):
+    files = [
+        ("files", ("test.txt", BytesIO(b"test content"), "text/plain"))
+    ]
+    
+    response = client.post("/api/v1/jobs/stream", files=files)
+    assert response.status_code == 400
+    assert "Invalid file type" in response.json()["detail"]
+
+def test_submit_job_stream_success(client, upload_dir, queued_jobs, sample_docx_content):
+    # Larger than UPLOAD_CHUNK_SIZE so the body is handed to the parser in several pieces
+    large_content = sample_docx_content * 20000
+    files = [
+        ("files", ("test1.docx", BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
+        ("files", ("test2.docx", BytesIO(large_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    ]
+    
+    response = client.post("/api/v1/jobs/stream", files=files)
+    assert response.status_code == 202
+    
+    data = response.json()
+    assert data["file_count"] == 2
+    assert queued_jobs == [data["job_id"]]
+    assert count_rows(Job) == 1
+    assert count_rows(JobFile) == 2
+    
+    job_upload_dir = upload_dir / data["job_id"]
+    assert (job_upload_dir / "test1.docx").read_bytes() == sample_docx_content
+    assert (job_upload_dir / "test2.docx").read_bytes() == large_content
+
+def test_submit_job_stream_file_too_large(client, upload_dir, queued_jobs, sample_docx_content, monkeypatch):
+    monkeypatch.setattr(settings, "max_file_size", len(sample_docx_content) - 1)
+    files = [
+        ("files", ("small.docx", BytesIO(b"PK"), "application/vnd.openxmlformats-officedocument.wordprocessingml.document")),
+        ("files", ("big.docx", BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    ]
+    
+    response = client.post("/api/v1/jobs/stream", files=files)
+    assert response.status_code == 400
+    assert "File too large: big.docx" in response.json()["detail"]
+    
+    assert os.listdir(upload_dir) == []
+    assert count_rows(Job) == 0
+    assert queued_jobs == []
+
+@pytest.mark.parametrize("endpoint", ["/api/v1/jobs", "/api/v1/jobs/stream"])
+@pytest.mark.parametrize("filename", ["../escaped.docx", "sub/escaped.docx", "..\\escaped.docx"])
+def test_submit_job_rejects_path_in_filename(client, upload_dir, queued_jobs, sample_docx_content, endpoint, filename):
+    files = [
+        ("files", (filename, BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    ]
+    
+    response = client.post(endpoint, files=files)
+    assert response.status_code == 400
+    assert "Invalid file name" in response.json()["detail"]
+    
+    # Nothing is written inside or next to the upload directory
+    assert os.listdir(upload_dir) == []
+    assert not (upload_dir.parent / "escaped.docx").exists()
+    assert count_rows(Job) == 0
+    assert queued_jobs == []
+
+@pytest.mark.parametrize("endpoint", ["/api/v1/jobs", "/api/v1/jobs/stream"])
+def test_submit_job_write_error_removes_uploads(client, upload_dir, queued_jobs, sample_docx_content, monkeypatch, endpoint):
+    def failing_save_upload(src, file_path):
+        with open(file_path, "wb") as f:
+            f.write(b"partial")
+        raise OSError("No space left on device")
+    
+    def failing_data_received(self, chunk):
+        self._file.write(b"partial")
+        raise OSError("No space left on device")
+    
+    monkeypatch.setattr("app.main._save_upload", failing_save_upload)
+    monkeypatch.setattr("app.main._JobUploadTarget.on_data_received", failing_data_received)
+    files = [
+        ("files", ("test1.docx", BytesIO(sample_docx_content), "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    ]
+    
+    with pytest.raises(OSError):
+        client.post(endpoint, files=files)
+    
+    assert os.listdir(upload_dir) == []
+    assert count_rows(Job) == 0
+    assert queued_jobs == []
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Serve downloads through X-Accel-Redirect from a temporary storage root"""
+    output_dir = tmp_path / "storage" / "outputs"
+    archive_dir = tmp_path / "storage" / "archives"
+    output_dir.mkdir(parents=True)
+    archive_dir.mkdir(parents=True)
+    monkeypatch.setattr(settings, "output_dir", str(output_dir))
+    monkeypatch.setattr(settings, "archive_dir", str(archive_dir))
+    monkeypatch.setattr(settings, "x_accel_redirect_prefix", "/protected/")
+    return output_dir, archive_dir
+
+def add_completed_job(archive_path, filename, output_path):
+    job_id = uuid.uuid4()
+    with Session(engine) as db:
+        db.add(Job(id=job_id, status=JobStatus.COMPLETED, file_count=1, archive_path=archive_path))
+        db.add(JobFile(
+            job_id=job_id,
+            filename=filename,
+            original_path=filename,
+            output_path=output_path,
+            status=FileStatus.COMPLETED
+        ))
+        db.commit()
+    return job_id
+
+def test_download_uses_x_accel_redirect(client, storage):
+    output_dir, archive_dir = storage
+    archive = archive_dir / "converted.zip"
+    archive.write_bytes(b"PK")
+    pdf = output_dir / "job" / "résumé 1.pdf"
+    pdf.parent.mkdir()
+    pdf.write_bytes(b"%PDF")
+    job_id = add_completed_job(str(archive), "résumé 1.docx", str(pdf))
+    
+    response = client.get(f"/api/v1/jobs/{job_id}/download")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == "/protected/archives/converted.zip"
+    assert response.headers["content-disposition"] == f'attachment; filename="converted_files_{job_id}.zip"'
+    
+    response = client.get(f"/api/v1/jobs/{job_id}/files/résumé 1.docx/download")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == "/protected/outputs/job/r%C3%A9sum%C3%A9%201.pdf"
+    assert response.headers["content-disposition"] == "attachment; filename*=utf-8''r%C3%A9sum%C3%A9%201.pdf"
+
+def test_download_outside_storage_skips_x_accel_redirect(storage, tmp_path):
+    elsewhere = tmp_path / "elsewhere.pdf"
+    elsewhere.write_bytes(b"%PDF")
+    
+    response = _file_download(str(elsewhere), media_type="application/pdf", filename="elsewhere.pdf")
+    assert isinstance(response, FileResponse)
+    assert "x-accel-redirect" not in response.headers
+
+class FakeAsyncRedis:
+    """In-memory stand-in for the asyncio Redis client that records TTLs"""
+    
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+    
+    async def get(self, key):
+        return self.data.get(key)
+    
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttls[key] = ex
+
+class BrokenAsyncRedis:
+    async def get(self, key):
+        raise redis.ConnectionError("Connection refused")
+    
+    async def set(self, key, value, ex=None):
+        raise redis.ConnectionError("Connection refused")
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeAsyncRedis()
+    monkeypatch.setattr(cache, "get_async_redis", lambda: fake)
+    return fake
+
+def add_job(status):
+    job_id = uuid.uuid4()
+    with Session(engine) as db:
+        db.add(Job(id=job_id, status=status))
+        db.commit()
+    return job_id
+
+@pytest.mark.parametrize("key, path", [
+    (cache.job_status_key, "/api/v1/jobs/{}"),
+    (cache.job_files_key, "/api/v1/jobs/{}/files"),
+])
+def test_cached_response_skips_database(client, fake_redis, key, path):
+    # No job row exists, so only the cache can answer
+    job_id = uuid.uuid4()
+    fake_redis.data[key(job_id)] = b'{"cached": true}'
+    
+    response = client.get(path.format(job_id))
+    assert response.status_code == 200
+    assert response.json() == {"cached": True}
+
+@pytest.mark.parametrize("status, ttl", [
+    (JobStatus.PENDING, cache.ACTIVE_JOB_TTL),
+    (JobStatus.IN_PROGRESS, cache.ACTIVE_JOB_TTL),
+    (JobStatus.COMPLETED, cache.FINISHED_JOB_TTL),
+    (JobStatus.FAILED, cache.FINISHED_JOB_TTL),
+])
+def test_response_cached_with_ttl_for_status(client, fake_redis, status, ttl):
+    job_id = add_job(status)
+    
+    response = client.get(f"/api/v1/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.json()["status"] == status.value
+    assert fake_redis.data[cache.job_status_key(job_id)] == response.content
+    assert fake_redis.ttls[cache.job_status_key(job_id)] == ttl
+    
+    response = client.get(f"/api/v1/jobs/{job_id}/files")
+    assert response.status_code == 200
+    assert fake_redis.data[cache.job_files_key(job_id)] == response.content
+    assert fake_redis.ttls[cache.job_files_key(job_id)] == ttl
+
+def test_redis_failure_falls_back_to_database(client, monkeypatch):
+    monkeypatch.setattr(cache, "get_async_redis", BrokenAsyncRedis)
+    job_id = add_job(JobStatus.IN_PROGRESS)
+    
+    response = client.get(f"/api/v1/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "IN_PROGRESS"
+    
+    response = client.get(f"/api/v1/jobs/{job_id}/files")
+    assert response.status_code == 200
+    assert response.json()["job_status"] == "IN_PROGRESS"
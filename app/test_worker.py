@@ -0,0 +1,285 @@
+import pytest
+import asyncio
+import hashlib
+import os
+import sys
+import time
+import uuid
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import cache, worker
+from app.config import settings
+from app.database import Base, Job, JobFile, PdfCache, JobStatus, FileStatus
+
+# Stand-in for LibreOffice: writes "<name>.pdf" for each input, but exits with
+# an error on inputs named "crash*" and hangs on inputs named "hang*"
+FAKE_LIBREOFFICE = f"""#!{sys.executable}
+import os, sys, time
+args = sys.argv[1:]
+outdir = args[args.index("--outdir") + 1]
+with open(os.path.join(outdir, "calls.log"), "a") as log:
+    log.write(" ".join(os.path.basename(p) for p in args[args.index("--outdir") + 2:]) + "\\n")
+for path in args[args.index("--outdir") + 2:]:
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.startswith("crash"):
+        sys.exit(1)
+    if name.startswith("hang"):
+        time.sleep(60)
+    with open(path, "rb") as src, open(os.path.join(outdir, name + ".pdf"), "wb") as dst:
+        dst.write(b"%PDF " + src.read())
+"""
+
+@pytest.fixture
+def fake_libreoffice(tmp_path, monkeypatch):
+    """Put the fake LibreOffice first on PATH"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "libreoffice"
+    script.write_text(FAKE_LIBREOFFICE)
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+@pytest.fixture
+def dirs(tmp_path):
+    upload_dir = tmp_path / "uploads"
+    output_dir = tmp_path / "outputs"
+    upload_dir.mkdir()
+    output_dir.mkdir()
+    return upload_dir, output_dir
+
+def make_docx(upload_dir, name, content=None):
+    path = upload_dir / name
+    path.write_bytes(content if content is not None else name.encode())
+    return str(path)
+
+def read_calls(output_dir):
+    return (output_dir / "calls.log").read_text().splitlines()
+
+def test_convert_docx_batch_success(fake_libreoffice, dirs):
+    upload_dir, output_dir = dirs
+    paths = [make_docx(upload_dir, f"good{i}.docx") for i in range(3)]
+    
+    pdf_paths, errors = worker.convert_docx_batch(paths, str(output_dir))
+    
+    assert errors == {}
+    assert set(pdf_paths) == set(paths)
+    assert read_calls(output_dir) == ["good0.docx good1.docx good2.docx"]
+
+def test_convert_docx_batch_crash_only_fails_bad_file(fake_libreoffice, dirs):
+    upload_dir, output_dir = dirs
+    paths = [make_docx(upload_dir, name) for name in ["good1.docx", "good2.docx", "crash.docx", "good3.docx"]]
+    
+    pdf_paths, errors = worker.convert_docx_batch(paths, str(output_dir))
+    
+    assert set(pdf_paths) == {paths[0], paths[1], paths[3]}
+    assert set(errors) == {paths[2]}
+    assert "LibreOffice conversion failed" in errors[paths[2]]
+    # good1 is kept; good2 (the last PDF written before the crash) and the
+    # files the crash never reached are retried individually
+    assert read_calls(output_dir)[1:] == ["good2.docx", "crash.docx", "good3.docx"]
+
+def test_convert_docx_batch_timeout_only_fails_hung_file(fake_libreoffice, dirs, monkeypatch):
+    monkeypatch.setattr(worker, "CONVERSION_TIMEOUT", 2)
+    upload_dir, output_dir = dirs
+    paths = [make_docx(upload_dir, name) for name in ["good1.docx", "hang.docx", "good2.docx"]]
+    
+    pdf_paths, errors = worker.convert_docx_batch(paths, str(output_dir))
+    
+    assert set(pdf_paths) == {paths[0], paths[2]}
+    assert set(errors) == {paths[1]}
+    assert "timeout" in errors[paths[1]]
+    # The hung file is failed from the batch run instead of being retried
+    assert read_calls(output_dir)[1:] == ["good1.docx", "good2.docx"]
+
+def test_convert_docx_batch_multiple_hung_files(fake_libreoffice, dirs, monkeypatch):
+    monkeypatch.setattr(worker, "CONVERSION_TIMEOUT", 2)
+    upload_dir, output_dir = dirs
+    names = ["good1.docx", "hang1.docx", "good2.docx", "hang2.docx", "good3.docx"]
+    paths = [make_docx(upload_dir, name) for name in names]
+    
+    pdf_paths, errors = worker.convert_docx_batch(paths, str(output_dir))
+    
+    assert set(pdf_paths) == {paths[0], paths[2], paths[4]}
+    assert set(errors) == {paths[1], paths[3]}
+    assert all("timeout" in error for error in errors.values())
+    # Only hang2, which the batch run never reached, costs a second timeout
+    assert read_calls(output_dir)[1:] == ["good1.docx", "good2.docx", "hang2.docx", "good3.docx"]
+
+def test_convert_docx_batch_stops_at_deadline(fake_libreoffice, dirs, monkeypatch):
+    monkeypatch.setattr(worker, "CONVERSION_TIMEOUT", 2)
+    upload_dir, output_dir = dirs
+    paths = [make_docx(upload_dir, name) for name in ["hang1.docx", "hang2.docx", "good1.docx"]]
+    
+    # hang2's retry is cut short at the deadline and good1 is never started
+    pdf_paths, errors = worker.convert_docx_batch(paths, str(output_dir), time.monotonic() + 3)
+    
+    assert pdf_paths == {}
+    assert errors[paths[2]] == worker.JOB_TIME_LIMIT_ERROR
+    assert read_calls(output_dir) == ["hang1.docx hang2.docx good1.docx", "hang2.docx"]
+
+def test_convert_docx_batch_past_deadline(fake_libreoffice, dirs):
+    upload_dir, output_dir = dirs
+    paths = [make_docx(upload_dir, "good1.docx")]
+    
+    pdf_paths, errors = worker.convert_docx_batch(paths, str(output_dir), time.monotonic())
+    
+    assert pdf_paths == {}
+    assert errors == {paths[0]: worker.JOB_TIME_LIMIT_ERROR}
+    assert not (output_dir / "calls.log").exists()
+
+
+@pytest.fixture
+def worker_db(tmp_path, dirs, monkeypatch):
+    """Run process_job against a SQLite database with Redis stubbed out"""
+    _, output_dir = dirs
+    archive_dir = tmp_path / "archives"
+    archive_dir.mkdir()
+    monkeypatch.setattr(settings, "output_dir", str(output_dir))
+    monkeypatch.setattr(settings, "archive_dir", str(archive_dir))
+    monkeypatch.setattr(worker, "load_job_manifest", lambda job_id: None)
+    monkeypatch.setattr(worker, "invalidate_job_cache", lambda job_id: None)
+    
+    engine = create_engine(f"sqlite:///{tmp_path / 'worker.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autoflush=False, bind=engine)
+    monkeypatch.setattr(worker, "SessionLocal", Session)
+    yield Session
+    engine.dispose()
+
+def make_job(Session, upload_dir, files):
+    """Record a job for the given (name, content) pairs and return its id"""
+    job_id = uuid.uuid4()
+    with Session() as db:
+        db.add(Job(id=job_id, file_count=len(files)))
+        for name, content in files:
+            db.add(JobFile(
+                job_id=job_id,
+                filename=name,
+                original_path=make_docx(upload_dir, name, content),
+                content_hash=hashlib.blake2b(content, digest_size=16).hexdigest()
+            ))
+        db.commit()
+    return str(job_id)
+
+def job_results(Session, job_id):
+    with Session() as db:
+        job = db.get(Job, uuid.UUID(job_id))
+        files = db.query(JobFile).filter(JobFile.job_id == job.id).all()
+        return job.status, {f.filename: (f.status, f.output_path) for f in files}
+
+def test_process_job_reuses_pdf_from_earlier_job(fake_libreoffice, dirs, worker_db):
+    upload_dir, output_dir = dirs
+    first = make_job(worker_db, upload_dir, [("a.docx", b"same")])
+    second = make_job(worker_db, upload_dir, [("b.docx", b"same")])
+    
+    worker.process_job(first)
+    worker.process_job(second)
+    
+    status, files = job_results(worker_db, second)
+    assert status == JobStatus.COMPLETED
+    assert files["b.docx"][0] == FileStatus.COMPLETED
+    assert open(files["b.docx"][1], "rb").read() == b"%PDF same"
+    # Only the first job ran LibreOffice
+    assert read_calls(output_dir / first) == ["a.docx"]
+    assert not (output_dir / second / "calls.log").exists()
+
+def test_process_job_converts_duplicates_once(fake_libreoffice, dirs, worker_db):
+    upload_dir, output_dir = dirs
+    job_id = make_job(worker_db, upload_dir, [("a.docx", b"same"), ("b.docx", b"same"), ("c.docx", b"other")])
+    
+    worker.process_job(job_id)
+    
+    status, files = job_results(worker_db, job_id)
+    assert status == JobStatus.COMPLETED
+    assert {name: result[0] for name, result in files.items()} == {
+        "a.docx": FileStatus.COMPLETED,
+        "b.docx": FileStatus.COMPLETED,
+        "c.docx": FileStatus.COMPLETED,
+    }
+    assert open(files["b.docx"][1], "rb").read() == b"%PDF same"
+    assert read_calls(output_dir / job_id) == ["a.docx c.docx"]
+
+def test_process_job_reconverts_when_cached_pdf_deleted(fake_libreoffice, dirs, worker_db):
+    upload_dir, output_dir = dirs
+    first = make_job(worker_db, upload_dir, [("a.docx", b"same")])
+    second = make_job(worker_db, upload_dir, [("b.docx", b"same")])
+    
+    worker.process_job(first)
+    os.remove(output_dir / first / "a.pdf")
+    worker.process_job(second)
+    
+    status, files = job_results(worker_db, second)
+    assert status == JobStatus.COMPLETED
+    assert files["b.docx"][0] == FileStatus.COMPLETED
+    assert read_calls(output_dir / second) == ["b.docx"]
+    # The cache now points at the new conversion
+    with worker_db() as db:
+        assert db.query(PdfCache.pdf_path).scalar() == files["b.docx"][1]
+
+class FakeRedis:
+    """In-memory stand-in for the sync and asyncio Redis clients"""
+    
+    def __init__(self):
+        self.data = {}
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+    
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+class FakeAsyncRedis:
+    def __init__(self, redis):
+        self.redis = redis
+    
+    async def get(self, key):
+        return self.redis.get(key)
+    
+    async def set(self, key, value, ex=None):
+        self.redis.set(key, value, ex=ex)
+
+def test_process_job_uses_redis_manifest(fake_libreoffice, dirs, worker_db, monkeypatch):
+    upload_dir, output_dir = dirs
+    job_id = make_job(worker_db, upload_dir, [("a.docx", b"one"), ("b.docx", b"two")])
+    with worker_db() as db:
+        job_files = [
+            {
+                "id": jf.id,
+                "job_id": jf.job_id,
+                "filename": jf.filename,
+                "original_path": jf.original_path,
+                "content_hash": jf.content_hash
+            }
+            for jf in db.query(JobFile).all()
+        ]
+    
+    # Publish the manifest the way the API does and read it back the way the worker does
+    fake_redis = FakeRedis()
+    monkeypatch.setattr(cache, "get_redis", lambda: fake_redis)
+    monkeypatch.setattr(cache, "get_async_redis", lambda: FakeAsyncRedis(fake_redis))
+    monkeypatch.setattr(worker, "load_job_manifest", cache.load_job_manifest)
+    asyncio.run(cache.store_job_manifest(uuid.UUID(job_id), job_files))
+    
+    statements = []
+    engine = worker_db.kw["bind"]
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        worker.process_job(job_id)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    
+    status, files = job_results(worker_db, job_id)
+    assert status == JobStatus.COMPLETED
+    assert {name: result[0] for name, result in files.items()} == {
+        "a.docx": FileStatus.COMPLETED,
+        "b.docx": FileStatus.COMPLETED,
+    }
+    assert read_calls(output_dir / job_id) == ["a.docx b.docx"]
+    # The file list came from Redis, not from job_files
+    assert not [s for s in statements if s.lstrip().upper().startswith("SELECT") and "job_files" in s]
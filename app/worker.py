@@ -1,14 +1,19 @@
 from celery import Celery
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import insert
 import os
+import shutil
 import zipfile
 import subprocess
 import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 
 from app.config import settings
-from app.database import Job, JobFile, JobStatus, FileStatus
+from app.database import create_database_engine, Job, JobFile, PdfCache, JobStatus, FileStatus
+from app.cache import invalidate_job_cache, load_job_manifest
 
 # Create Celery app
 celery_app = Celery(
@@ -17,8 +22,29 @@ celery_app = Celery(
     backend=settings.redis_url
 )
 
-# Database setup for worker
-engine = create_engine(settings.database_url)
+# Number of files converted by one LibreOffice process and whose status
+# updates are committed together
+PROGRESS_BATCH_SIZE = 25
+
+# Upper bound for one LibreOffice process, kept well under task_soft_time_limit
+CONVERSION_TIMEOUT = 5 * 60  # 5 minutes
+
+TASK_SOFT_TIME_LIMIT = 25 * 60  # 25 minutes
+
+# Part of the task time limit kept back for archiving and the final status
+# update; conversions still pending past this point are failed instead
+FINALIZE_TIME_RESERVE = 3 * 60  # 3 minutes
+
+JOB_TIME_LIMIT_ERROR = "Conversion skipped - job time limit reached"
+
+class ConversionTimeout(Exception):
+    """LibreOffice did not finish within its time limit"""
+
+# Read size used when copying PDFs into the archive
+ZIP_COPY_BUFFER_SIZE = 1 << 20  # 1 MiB
+
+# Database setup for worker (shares the API's engine configuration)
+engine = create_database_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db_session():
@@ -28,17 +54,30 @@ def get_db_session():
 def process_job(job_id: str):
     """Process a conversion job by converting all DOCX files to PDF"""
     db = get_db_session()
+    # Celery passes the id as a string; filter on a UUID so it binds on any backend
+    job_uuid = uuid.UUID(job_id)
+    deadline = time.monotonic() + TASK_SOFT_TIME_LIMIT - FINALIZE_TIME_RESERVE
     
     try:
-        job = db.query(Job).filter(Job.id == job_id).first()
-        if not job:
+        # Update job status to IN_PROGRESS without loading the row
+        if not db.query(Job).filter(Job.id == job_uuid).update({"status": JobStatus.IN_PROGRESS}):
             return f"Job {job_id} not found"
-        
-        # Update job status to IN_PROGRESS
-        job.status = JobStatus.IN_PROGRESS
         db.commit()
+        invalidate_job_cache(job_id)
         
-        job_files = db.query(JobFile).filter(JobFile.job_id == job_id).all()
+        # The API publishes the file list to Redis at submission; fall back to
+        # Postgres if it has expired or Redis was unavailable
+        manifest = load_job_manifest(job_id)
+        if manifest is not None:
+            job_files = [
+                (uuid.UUID(file_id), original_path, content_hash)
+                for file_id, original_path, content_hash in manifest
+            ]
+        else:
+            # Load only the columns we need so commits don't expire and reload each row
+            job_files = db.query(
+                JobFile.id, JobFile.original_path, JobFile.content_hash
+            ).filter(JobFile.job_id == job_uuid).all()
         
         # Create output directory for this job
         job_output_dir = os.path.join(settings.output_dir, job_id)
@@ -46,109 +85,292 @@ def process_job(job_id: str):
         
         converted_files = []
         failed_files = 0
+        updates = []
+        cache_entries = {}
         
-        for job_file in job_files:
-            try:
-                # Update file status to IN_PROGRESS
-                job_file.status = FileStatus.IN_PROGRESS
-                db.commit()
+        def file_completed(file_id, pdf_path):
+            updates.append({
+                "id": file_id,
+                "output_path": pdf_path,
+                "status": FileStatus.COMPLETED,
+                "completed_at": datetime.utcnow()
+            })
+            converted_files.append(pdf_path)
+        
+        def file_failed(file_id, error_message):
+            nonlocal failed_files
+            updates.append({
+                "id": file_id,
+                "status": FileStatus.FAILED,
+                "error_message": error_message
+            })
+            failed_files += 1
+        
+        # Identical uploads are only converted once: files whose content was
+        # converted by an earlier job reuse that PDF, and repeats within this
+        # job wait for the first copy to be converted
+        content_hashes = {content_hash for _, _, content_hash in job_files if content_hash}
+        cached_pdfs = dict(
+            db.query(PdfCache.content_hash, PdfCache.pdf_path)
+            .filter(PdfCache.content_hash.in_(content_hashes))
+            .all()
+        ) if content_hashes else {}
+        
+        to_convert = []
+        duplicates = {}
+        for file_id, original_path, content_hash in job_files:
+            if content_hash in cached_pdfs:
+                pdf_path = link_cached_pdf(cached_pdfs[content_hash], original_path, job_output_dir)
+                if pdf_path:
+                    file_completed(file_id, pdf_path)
+                    continue
+                # The cached PDF has been removed; convert this file again
+                del cached_pdfs[content_hash]
+            
+            if content_hash in duplicates:
+                duplicates[content_hash].append((file_id, original_path))
+            else:
+                if content_hash:
+                    duplicates[content_hash] = []
+                to_convert.append((file_id, original_path, content_hash))
+        
+        # Batches are converted in parallel by separate LibreOffice processes.
+        # File status changes are buffered and flushed whenever a batch finishes;
+        # each flush also marks newly started batches IN_PROGRESS so pollers
+        # still see progress.
+        batches = iter([
+            to_convert[start:start + PROGRESS_BATCH_SIZE]
+            for start in range(0, len(to_convert), PROGRESS_BATCH_SIZE)
+        ])
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=settings.conversion_workers) as executor:
+            while True:
+                while len(in_flight) < settings.conversion_workers:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    updates.extend({"id": file_id, "status": FileStatus.IN_PROGRESS} for file_id, _, _ in batch)
+                    future = executor.submit(
+                        convert_docx_batch, [path for _, path, _ in batch], job_output_dir, deadline
+                    )
+                    in_flight[future] = batch
                 
-                # Convert DOCX to PDF
-                pdf_path = convert_docx_to_pdf(job_file.original_path, job_output_dir)
+                db.bulk_update_mappings(JobFile, updates)
+                if cache_entries:
+                    stmt = insert(PdfCache).values([
+                        {"content_hash": content_hash, "pdf_path": pdf_path}
+                        for content_hash, pdf_path in cache_entries.items()
+                    ])
+                    db.execute(stmt.on_conflict_do_update(
+                        index_elements=[PdfCache.content_hash],
+                        set_={"pdf_path": stmt.excluded.pdf_path}
+                    ))
+                db.commit()
+                invalidate_job_cache(job_id)
+                updates = []
+                cache_entries = {}
                 
-                if pdf_path and os.path.exists(pdf_path):
-                    job_file.output_path = pdf_path
-                    job_file.status = FileStatus.COMPLETED
-                    job_file.completed_at = datetime.utcnow()
-                    converted_files.append(pdf_path)
-                else:
-                    job_file.status = FileStatus.FAILED
-                    job_file.error_message = "Conversion failed - output file not created"
-                    failed_files += 1
+                if not in_flight:
+                    break
                 
-            except Exception as e:
-                job_file.status = FileStatus.FAILED
-                job_file.error_message = str(e)
-                failed_files += 1
-            
-            db.commit()
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    try:
+                        pdf_paths, errors = future.result()
+                    except Exception as e:
+                        pdf_paths, errors = {}, {path: str(e) for _, path, _ in batch}
+                    
+                    for file_id, original_path, content_hash in batch:
+                        pdf_path = pdf_paths.get(original_path)
+                        error_message = errors.get(original_path, "Conversion failed - output file not created")
+                        if pdf_path:
+                            file_completed(file_id, pdf_path)
+                            if content_hash:
+                                cache_entries[content_hash] = pdf_path
+                        else:
+                            file_failed(file_id, error_message)
+                        
+                        # Resolve identical files that were waiting on this conversion
+                        for duplicate_id, duplicate_path in duplicates.get(content_hash, []):
+                            duplicate_pdf = pdf_path and link_cached_pdf(pdf_path, duplicate_path, job_output_dir)
+                            if duplicate_pdf:
+                                file_completed(duplicate_id, duplicate_pdf)
+                            else:
+                                file_failed(duplicate_id, error_message)
         
         # Create ZIP archive if we have any converted files
+        archive_path = None
         if converted_files:
-            archive_path = create_zip_archive(job_id, converted_files)
-            job.archive_path = archive_path
+            archive_path = create_zip_archive(job_id, job_output_dir, converted_files)
         
         # Update job status
-        if failed_files == len(job_files):
-            job.status = JobStatus.FAILED
-        else:
-            job.status = JobStatus.COMPLETED
-        
-        job.completed_at = datetime.utcnow()
+        db.query(Job).filter(Job.id == job_uuid).update({
+            "status": JobStatus.FAILED if failed_files == len(job_files) else JobStatus.COMPLETED,
+            "archive_path": archive_path,
+            "completed_at": datetime.utcnow()
+        })
         db.commit()
+        invalidate_job_cache(job_id)
         
         return f"Job {job_id} completed. {len(converted_files)} files converted, {failed_files} failed."
         
     except Exception as e:
         # Mark job as failed
-        job = db.query(Job).filter(Job.id == job_id).first()
-        if job:
-            job.status = JobStatus.FAILED
-            db.commit()
+        db.rollback()
+        db.query(Job).filter(Job.id == job_uuid).update({"status": JobStatus.FAILED})
+        db.commit()
+        invalidate_job_cache(job_id)
         return f"Job {job_id} failed: {str(e)}"
     
     finally:
         db.close()
 
-def convert_docx_to_pdf(docx_path: str, output_dir: str) -> str:
-    """Convert a DOCX file to PDF using LibreOffice"""
+def convert_docx_batch(docx_paths: list, output_dir: str, deadline: float = None) -> tuple:
+    """Convert DOCX files to PDF by a time.monotonic() deadline, returning (pdf_paths, errors) keyed by input path"""
+    def time_left():
+        if deadline is None:
+            return CONVERSION_TIMEOUT
+        return min(CONVERSION_TIMEOUT, deadline - time.monotonic())
+    
+    if time_left() <= 0:
+        return {}, {docx_path: JOB_TIME_LIMIT_ERROR for docx_path in docx_paths}
+    
+    # One LibreOffice process for the whole batch amortizes its startup cost
     try:
-        # Get the base filename without extension
-        base_name = os.path.splitext(os.path.basename(docx_path))[0]
-        pdf_filename = f"{base_name}.pdf"
-        
-        # Use LibreOffice to convert DOCX to PDF
-        cmd = [
-            "libreoffice",
-            "--headless",
-            "--convert-to", "pdf",
-            "--outdir", output_dir,
-            docx_path
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minute timeout
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"LibreOffice conversion failed: {result.stderr}")
-        
-        pdf_path = os.path.join(output_dir, pdf_filename)
-        
-        if not os.path.exists(pdf_path):
-            raise Exception("PDF file was not created")
-        
-        return pdf_path
+        run_libreoffice(docx_paths, output_dir, time_left())
+        return find_converted_pdfs(docx_paths, output_dir), {}
+    except Exception as e:
+        batch_error = e
+    
+    pdf_paths = find_converted_pdfs(docx_paths, output_dir)
+    errors = {}
+    
+    # LibreOffice converts in order, so after a timeout the first file without
+    # a PDF is the one it was stuck on; don't spend another timeout on it
+    if isinstance(batch_error, ConversionTimeout):
+        hung = next((docx_path for docx_path in docx_paths if docx_path not in pdf_paths), None)
+        if hung:
+            errors[hung] = str(batch_error)
+    
+    # A crash or timeout stops LibreOffice partway through the batch. Keep the
+    # PDFs it finished, except the last one, which may have been cut short, and
+    # retry the rest one file at a time so a bad document only fails itself.
+    finished = [docx_path for docx_path in docx_paths if docx_path in pdf_paths]
+    if finished:
+        os.remove(pdf_paths.pop(finished[-1]))
+    
+    for docx_path in docx_paths:
+        if docx_path in pdf_paths or docx_path in errors:
+            continue
+        if len(docx_paths) == 1:
+            errors[docx_path] = str(batch_error)
+            continue
+        timeout = time_left()
+        if timeout <= 0:
+            errors[docx_path] = JOB_TIME_LIMIT_ERROR
+            continue
+        try:
+            run_libreoffice([docx_path], output_dir, timeout)
+        except Exception as e:
+            errors[docx_path] = str(e)
+            continue
+        pdf_paths.update(find_converted_pdfs([docx_path], output_dir))
+    
+    return pdf_paths, errors
+
+def run_libreoffice(docx_paths: list, output_dir: str, timeout: float):
+    """Run one LibreOffice process converting the given DOCX files to PDF"""
+    try:
+        # Each LibreOffice process needs its own user profile, otherwise
+        # concurrent conversions attach to the first running instance
+        with tempfile.TemporaryDirectory(prefix="lo_profile_") as profile_dir:
+            # Use LibreOffice to convert all DOCX files to PDF
+            cmd = [
+                "libreoffice",
+                f"-env:UserInstallation=file://{profile_dir}",
+                "--headless",
+                "--convert-to", "pdf",
+                "--outdir", output_dir,
+                *docx_paths
+            ]
+            
+            # Discard stdout and send stderr to an unlinked temp file that is
+            # only read if the conversion fails, instead of draining pipes
+            with tempfile.TemporaryFile() as stderr:
+                result = subprocess.run(
+                    cmd,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr,
+                    timeout=timeout
+                )
+                
+                if result.returncode != 0:
+                    stderr.seek(0)
+                    error_output = stderr.read().decode(errors="replace")
+                    raise Exception(f"LibreOffice conversion failed: {error_output}")
         
     except subprocess.TimeoutExpired:
-        raise Exception("Conversion timeout - file may be too large or complex")
+        raise ConversionTimeout("Conversion timeout - file may be too large or complex")
     except Exception as e:
         raise Exception(f"Conversion error: {str(e)}")
 
-def create_zip_archive(job_id: str, file_paths: list) -> str:
+def find_converted_pdfs(docx_paths: list, output_dir: str) -> dict:
+    """Map each DOCX path to its PDF in output_dir, for the PDFs that exist"""
+    pdf_paths = {}
+    for docx_path in docx_paths:
+        # Get the base filename without extension
+        base_name = os.path.splitext(os.path.basename(docx_path))[0]
+        pdf_path = os.path.join(output_dir, f"{base_name}.pdf")
+        if os.path.exists(pdf_path):
+            pdf_paths[docx_path] = pdf_path
+    return pdf_paths
+
+def link_cached_pdf(cached_pdf_path: str, docx_path: str, output_dir: str):
+    """Hard-link or copy a converted PDF as the output for an identical DOCX, or None if it is gone"""
+    base_name = os.path.splitext(os.path.basename(docx_path))[0]
+    pdf_path = os.path.join(output_dir, f"{base_name}.pdf")
+    
+    try:
+        os.link(cached_pdf_path, pdf_path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        # The output already exists (e.g. a retried task) or the cached PDF
+        # lives on another filesystem
+        if not os.path.exists(pdf_path) or not os.path.samefile(cached_pdf_path, pdf_path):
+            shutil.copyfile(cached_pdf_path, pdf_path)
+    
+    return pdf_path
+
+def create_zip_archive(job_id: str, output_dir: str, file_paths: list) -> str:
     """Create a ZIP archive containing all converted PDF files"""
     archive_filename = f"converted_files_{job_id}.zip"
     archive_path = os.path.join(settings.archive_dir, archive_filename)
     
-    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    # One directory scan gives the size and mtime of every PDF, replacing the
+    # separate exists() and ZipInfo.from_file() stats per file
+    with os.scandir(output_dir) as it:
+        file_stats = {entry.path: entry.stat() for entry in it if entry.is_file()}
+    
+    # One buffer is reused for every file; reads go straight into it from the
+    # unbuffered file descriptor instead of allocating a new bytes per chunk
+    buffer = memoryview(bytearray(ZIP_COPY_BUFFER_SIZE))
+    
+    # PDFs are already compressed internally, so store them as-is
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
         for file_path in file_paths:
-            if os.path.exists(file_path):
-                # Add file to zip with just the filename (not the full path)
-                arcname = os.path.basename(file_path)
-                zipf.write(file_path, arcname)
+            st = file_stats.get(file_path)
+            if st is None:
+                continue
+            
+            # Add file to zip with just the filename (not the full path)
+            zinfo = zipfile.ZipInfo(os.path.basename(file_path), time.localtime(st.st_mtime)[:6])
+            zinfo.file_size = st.st_size
+            zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+            with open(file_path, 'rb', buffering=0) as src, zipf.open(zinfo, 'w') as dst:
+                while n := src.readinto(buffer):
+                    dst.write(buffer[:n])
     
     return archive_path
 
@@ -161,7 +383,7 @@ celery_app.conf.update(
     enable_utc=True,
     task_track_started=True,
     task_time_limit=30 * 60,  # 30 minutes
-    task_soft_time_limit=25 * 60,  # 25 minutes
+    task_soft_time_limit=TASK_SOFT_TIME_LIMIT,
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
 )
\ No newline at end of file